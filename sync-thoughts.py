@@ -13,15 +13,19 @@ Requirements:
 
 Usage:
   python3 sync-thoughts.py
+  python3 sync-thoughts.py --watch 60   # re-sync whenever the note changes
 """
 
+import argparse
 import json
 import os
+import re
 import shutil
 import sqlite3
-import subprocess
 import sys
 import tempfile
+import time
+import zlib
 from datetime import datetime, timezone
 from pathlib import Path
 
@@ -29,24 +33,86 @@ from pathlib import Path
 NOTE_TITLE = "Thoughts - Personal Website"
 SCRIPT_DIR = Path(__file__).parent
 OUTPUT_FILE = SCRIPT_DIR / "thoughts.json"
+# Modification date of the note OUTPUT_FILE was last built from (gitignored)
+MTIME_FILE = SCRIPT_DIR / ".thoughts-mtime"
 NOTES_DB = Path.home() / "Library/Group Containers/group.com.apple.notes/NoteStore.sqlite"
 
-# Apple Notes stores dates as seconds since 2001-01-01 (Core Data epoch)
-CORE_DATA_EPOCH = datetime(2001, 1, 1, tzinfo=timezone.utc)
+# Apple Notes stores dates as seconds since 2001-01-01 (Core Data epoch),
+# which is this many seconds after the Unix epoch
+CORE_DATA_OFFSET = 978307200
 
+# Thoughts are separated by one or more blank (or whitespace-only) lines
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
 
-def _read_varint(buf, pos):
-    """Read a protobuf varint, return (value, new_pos)."""
-    result = 0
-    shift = 0
-    while pos < len(buf):
-        b = buf[pos]
+# Note bodies are inflated this many bytes at a time, stopping as soon as
+# the text field has been fully decompressed
+INFLATE_CHUNK_SIZE = 16384
+
+
+def _read_varint(mv, pos, end):
+    """Read a protobuf varint from mv[pos:end], return (value, new_pos).
+
+    Single-byte varints (tags, short lengths) are by far the most common,
+    so they return without entering the loop. Longer varints are capped at
+    10 bytes, the protobuf maximum. Raises ValueError if the varint would
+    run past end into the enclosing message.
+    """
+    if pos >= end:
+        raise ValueError("truncated varint")
+    b = mv[pos]
+    if b < 0x80:
+        return b, pos + 1
+    result = b & 0x7F
+    if pos + 1 >= end:
+        raise ValueError("truncated varint")
+    b = mv[pos + 1]
+    if b < 0x80:
+        return result | (b << 7), pos + 2
+    result |= (b & 0x7F) << 7
+    shift = 14
+    for i in range(pos + 2, min(pos + 10, end)):
+        b = mv[i]
         result |= (b & 0x7F) << shift
-        pos += 1
-        if not (b & 0x80):
-            break
+        if b < 0x80:
+            return result, i + 1
         shift += 7
-    return result, pos
+    raise ValueError("truncated or oversized varint")
+
+
+def _enter_field(mv, pos, end, field_num):
+    """Find length-delimited field field_num in the message mv[pos:end].
+
+    Returns the (start, end) bounds of the field's payload, or None if the
+    message doesn't contain it. Other fields are skipped without decoding.
+    """
+    while pos < end:
+        tag, pos = _read_varint(mv, pos, end)
+        wire_type = tag & 0x07
+        if wire_type == 0:  # varint
+            _, pos = _read_varint(mv, pos, end)
+        elif wire_type == 2:  # length-delimited
+            length, pos = _read_varint(mv, pos, end)
+            if tag >> 3 == field_num:
+                return pos, min(pos + length, end)
+            pos += length
+        else:
+            return None
+    return None
+
+
+def _locate_text(mv, end):
+    """Return the (start, end) bounds of the note text in mv[:end], or None.
+
+    Raises IndexError if the text lies beyond the bytes available in mv,
+    and ValueError if the protobuf is malformed.
+    """
+    bounds = (0, end)
+    # Descend outer field 2 -> field 3 -> field 2 (the note text)
+    for field_num in (2, 3, 2):
+        bounds = _enter_field(mv, *bounds, field_num)
+        if bounds is None:
+            return None
+    return bounds
 
 
 def extract_text_from_note_data(data):
@@ -54,165 +120,338 @@ def extract_text_from_note_data(data):
 
     The note body structure is: outer.field2.field3.field2 = UTF-8 text.
     We navigate the protobuf fields to extract the text cleanly,
-    avoiding binary formatting metadata that follows it.
+    avoiding binary formatting metadata that follows it. Only the parts
+    of the schema we read are relevant:
+
+        message NoteStoreProto { Document document = 2; }
+        message Document       { Note note = 3; }
+        message Note           { string note_text = 2; }
+
+    Parsing by hand keeps the script dependency-free; everything else in
+    the message (attribute runs, embedded objects) is skipped unread.
+
+    Since the path is fixed, each level is a single scan for the wanted
+    field. Nested messages are tracked as (start, end) offsets into one
+    memoryview, so nothing is copied until the text itself is decoded.
+    The text comes before the formatting metadata, so the body is inflated
+    in chunks and decompression stops once the text is complete.
     """
     if not data:
         return ""
-    try:
-        import gzip
-        buf = gzip.decompress(data)
-
-        # Navigate: skip outer field 1 (tag 08), enter field 2 (tag 12)
-        pos = 0
-        while pos < len(buf):
-            tag, pos = _read_varint(buf, pos)
-            field_num = tag >> 3
-            wire_type = tag & 0x07
-            if wire_type == 0:  # varint
-                _, pos = _read_varint(buf, pos)
-            elif wire_type == 2:  # length-delimited
-                length, pos = _read_varint(buf, pos)
-                if field_num == 2:
-                    # Enter outer field 2, parse its inner fields
-                    inner = buf[pos:pos + length]
-                    ipos = 0
-                    while ipos < len(inner):
-                        itag, ipos = _read_varint(inner, ipos)
-                        inum = itag >> 3
-                        iwire = itag & 0x07
-                        if iwire == 0:
-                            _, ipos = _read_varint(inner, ipos)
-                        elif iwire == 2:
-                            ilen, ipos = _read_varint(inner, ipos)
-                            if inum == 3:
-                                # Enter field 3, find subfield 2 = text
-                                sub = inner[ipos:ipos + ilen]
-                                spos = 0
-                                while spos < len(sub):
-                                    stag, spos = _read_varint(sub, spos)
-                                    snum = stag >> 3
-                                    swire = stag & 0x07
-                                    if swire == 0:
-                                        _, spos = _read_varint(sub, spos)
-                                    elif swire == 2:
-                                        slen, spos = _read_varint(sub, spos)
-                                        if snum == 2:
-                                            return sub[spos:spos + slen].decode('utf-8').strip()
-                                        spos += slen
-                                    else:
-                                        break
-                            ipos += ilen
-                        else:
-                            break
-                pos += length
-            else:
-                break
-        return ""
-    except Exception:
+    # 16 + MAX_WBITS: expect a gzip header
+    inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    buf = bytearray()
+    pending = data
+    while True:
         try:
+            chunk = inflater.decompress(pending, INFLATE_CHUNK_SIZE)
+        except zlib.error:
+            # Not a gzip stream: treat the body as plain text
             return data.decode('utf-8', errors='ignore').strip()
-        except Exception:
-            return ""
+        pending = inflater.unconsumed_tail
+        buf += chunk
+        available = len(buf)
+        complete = inflater.eof or not (chunk or pending)
+        with memoryview(buf) as mv:
+            # Until the body is fully inflated its total length is
+            # unknown, so let the top-level scan run off the end
+            try:
+                bounds = _locate_text(mv, available if complete else sys.maxsize)
+                if bounds is None:
+                    return ""
+                start, end = bounds
+                if complete or end <= available:
+                    return bytes(mv[start:end]).decode('utf-8').strip()
+            except IndexError:
+                # Ran past the inflated bytes: wait for more, unless there
+                # are none, in which case the protobuf is truncated
+                if complete:
+                    return ""
+            except ValueError:
+                # Malformed protobuf (bad varint) or text that isn't UTF-8
+                return ""
+
+
+def _load_cached_thoughts(modified_ts):
+    """Return thoughts from OUTPUT_FILE if it was written for modified_ts.
+
+    The note's modification timestamp from the last sync is kept in
+    MTIME_FILE; when it matches, the note hasn't changed and there's no
+    need to decompress and parse it again.
+    """
+    if modified_ts is None:
+        return None
+    try:
+        if json.loads(MTIME_FILE.read_text()) != modified_ts:
+            return None
+        with open(OUTPUT_FILE, encoding="utf-8") as f:
+            return json.load(f).get("thoughts")
+    except (OSError, ValueError):
+        return None
+
+
+# Find the note titled "Thoughts"
+NOTE_QUERY = """
+    SELECT
+        n.ZMODIFICATIONDATE1 AS modified,
+        nd.ZDATA AS body
+    FROM ZICCLOUDSYNCINGOBJECT n
+    LEFT JOIN ZICNOTEDATA nd
+        ON nd.ZNOTE = n.Z_PK
+    WHERE n.ZTITLE1 = ?
+        AND n.ZMARKEDFORDELETION IS NOT 1
+    ORDER BY n.ZMODIFICATIONDATE1 DESC
+    LIMIT 1
+"""
 
+# Same lookup without the body, used to poll for changes in --watch mode
+MTIME_QUERY = """
+    SELECT n.ZMODIFICATIONDATE1 AS modified
+    FROM ZICCLOUDSYNCINGOBJECT n
+    WHERE n.ZTITLE1 = ?
+        AND n.ZMARKEDFORDELETION IS NOT 1
+    ORDER BY n.ZMODIFICATIONDATE1 DESC
+    LIMIT 1
+"""
 
-def get_thoughts():
-    """Read the 'Thoughts' note from Apple Notes database."""
-    if not NOTES_DB.exists():
-        print(f"Error: Notes database not found at {NOTES_DB}", file=sys.stderr)
-        sys.exit(1)
+
+def _connect(db_uri):
+    """Open a read-only-tuned connection to the Notes database at db_uri."""
+    conn = sqlite3.connect(db_uri, uri=True)
+    try:
+        conn.executescript("""
+            PRAGMA query_only=1;
+            PRAGMA mmap_size=30000000000;
+            PRAGMA cache_size=-64000;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA busy_timeout=5000;
+        """)
+    except sqlite3.Error:
+        conn.close()
+        raise
+    return conn
+
+
+def _fetch_note(conn):
+    """Fetch the (modified, body) row for the note, or None."""
+    cursor = conn.cursor()
+    cursor.arraysize = 1
+    cursor.execute(NOTE_QUERY, (NOTE_TITLE,))
+    return cursor.fetchone()
+
+
+def _query_note(db_uri):
+    """Open the Notes database at db_uri and fetch the note row."""
+    conn = _connect(db_uri)
+    try:
+        return _fetch_note(conn)
+    finally:
+        conn.close()
+
+
+def _read_note_row():
+    """Fetch the note row, reading the live database in place if possible.
+
+    A read-only connection coexists with Notes' WAL, so usually nothing
+    needs copying. If SQLite refuses (e.g. the -shm file isn't readable),
+    fall back to querying a copy of the database and its WAL.
+    """
+    try:
+        return _query_note(f"{NOTES_DB.as_uri()}?mode=ro")
+    except sqlite3.OperationalError:
+        pass
 
     # Copy database to temp location (Notes may have it locked)
     with tempfile.TemporaryDirectory() as tmp:
         db_copy = os.path.join(tmp, "NoteStore.sqlite")
-        # Copy the database and WAL files
-        shutil.copy2(NOTES_DB, db_copy)
+        # Copy the database and WAL files. copyfile skips the metadata
+        # copy2 preserves and uses the OS fast-copy path; the -shm index
+        # is rebuilt from the WAL on open, so it isn't needed.
+        shutil.copyfile(NOTES_DB, db_copy)
         wal = str(NOTES_DB) + "-wal"
-        shm = str(NOTES_DB) + "-shm"
         if os.path.exists(wal):
-            shutil.copy2(wal, db_copy + "-wal")
-        if os.path.exists(shm):
-            shutil.copy2(shm, db_copy + "-shm")
-
-        conn = sqlite3.connect(db_copy)
-        cursor = conn.cursor()
-
-        # Find the note titled "Thoughts"
-        cursor.execute("""
-            SELECT
-                n.Z_PK,
-                n.ZTITLE1 AS title,
-                n.ZMODIFICATIONDATE1 AS modified,
-                nd.ZDATA AS body
-            FROM ZICCLOUDSYNCINGOBJECT n
-            LEFT JOIN ZICNOTEDATA nd
-                ON nd.ZNOTE = n.Z_PK
-            WHERE n.ZTITLE1 = ?
-                AND n.ZMARKEDFORDELETION != 1
-            ORDER BY n.ZMODIFICATIONDATE1 DESC
-            LIMIT 1
-        """, (NOTE_TITLE,))
-
-        row = cursor.fetchone()
-        conn.close()
+            shutil.copyfile(wal, db_copy + "-wal")
 
-        if not row:
-            print(f"Error: No note titled '{NOTE_TITLE}' found.", file=sys.stderr)
-            sys.exit(1)
+        return _query_note(Path(db_copy).as_uri())
 
-        pk, title, modified_ts, body_data = row
 
-        # Parse modification date
-        if modified_ts:
-            modified_dt = CORE_DATA_EPOCH + __import__('datetime').timedelta(seconds=modified_ts)
-            mod_date = modified_dt.strftime("%Y-%m-%d")
-        else:
-            mod_date = datetime.now().strftime("%Y-%m-%d")
-
-        # Extract text
-        text = extract_text_from_note_data(body_data)
-        if not text:
-            print(f"Warning: Note '{NOTE_TITLE}' appears empty.", file=sys.stderr)
-            return []
-
-        # Split by blank lines into paragraphs (thoughts)
-        # Remove the title line if it appears at the start
-        lines = text.split('\n')
-        if lines and lines[0].strip() == NOTE_TITLE:
-            lines = lines[1:]
-
-        # Group into paragraphs separated by blank lines
-        paragraphs = []
-        current = []
-        for line in lines:
-            if line.strip() == '':
-                if current:
-                    paragraphs.append(' '.join(current))
-                    current = []
-            else:
-                current.append(line.strip())
-        if current:
-            paragraphs.append(' '.join(current))
-
-        # Filter out empty paragraphs
-        thoughts = []
-        for p in paragraphs:
-            p = p.strip()
-            if p:
-                thoughts.append({"text": p, "date": mod_date})
-
-        return thoughts
+def _parse_note_row(row):
+    """Turn a (modified, body) note row into (thoughts, modified_ts)."""
+    if not row:
+        print(f"Error: No note titled '{NOTE_TITLE}' found.", file=sys.stderr)
+        sys.exit(1)
 
+    modified_ts, body_data = row
+
+    cached = _load_cached_thoughts(modified_ts)
+    if cached is not None:
+        return cached, modified_ts
+
+    # Parse modification date
+    if modified_ts:
+        modified_dt = datetime.fromtimestamp(modified_ts + CORE_DATA_OFFSET, tz=timezone.utc)
+        mod_date = modified_dt.strftime("%Y-%m-%d")
+    else:
+        mod_date = datetime.now().strftime("%Y-%m-%d")
+
+    # Extract text
+    text = extract_text_from_note_data(body_data)
+    if not text:
+        print(f"Warning: Note '{NOTE_TITLE}' appears empty.", file=sys.stderr)
+        return [], modified_ts
+
+    # Remove the title line if it appears at the start
+    first, _, rest = text.partition('\n')
+    if first.strip() == NOTE_TITLE:
+        text = rest
+
+    # Split by blank lines into paragraphs (thoughts), joining the lines
+    # of each paragraph with single spaces
+    thoughts = []
+    for p in PARAGRAPH_BREAK.split(text):
+        p = ' '.join(p.split())
+        if p:
+            thoughts.append({"text": p, "date": mod_date})
+
+    return thoughts, modified_ts
+
+
+def get_thoughts():
+    """Read the 'Thoughts' note from Apple Notes database.
+
+    Returns (thoughts, modified_ts).
+    """
+    if not NOTES_DB.exists():
+        print(f"Error: Notes database not found at {NOTES_DB}", file=sys.stderr)
+        sys.exit(1)
+
+    return _parse_note_row(_read_note_row())
 
-def main():
-    thoughts = get_thoughts()
 
+def write_thoughts(thoughts, modified_ts):
+    """Write thoughts to OUTPUT_FILE and the note's modification date to MTIME_FILE.
+
+    OUTPUT_FILE is left untouched if its contents wouldn't change; otherwise
+    it's replaced atomically so readers never see a partial write.
+    """
     data = {"thoughts": thoughts}
 
-    with open(OUTPUT_FILE, 'w') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
-        f.write('\n')
+    payload = (json.dumps(data, indent=2, ensure_ascii=False) + '\n').encode('utf-8')
+    try:
+        unchanged = OUTPUT_FILE.read_bytes() == payload
+    except FileNotFoundError:
+        unchanged = False
+
+    if not unchanged:
+        # A unique temp name, so overlapping writers (e.g. --watch alongside
+        # the LaunchAgent run) can't truncate each other's file mid-replace
+        tmp = tempfile.NamedTemporaryFile(dir=OUTPUT_FILE.parent, prefix='thoughts.',
+                                          suffix='.tmp', delete=False)
+        try:
+            with tmp:
+                tmp.write(payload)
+            # NamedTemporaryFile creates the file 0600; keep it world-readable
+            os.chmod(tmp.name, 0o644)
+            os.replace(tmp.name, OUTPUT_FILE)
+        except BaseException:
+            os.unlink(tmp.name)
+            raise
+
+    if modified_ts is None:
+        MTIME_FILE.unlink(missing_ok=True)
+    else:
+        MTIME_FILE.write_text(json.dumps(modified_ts))
+
+    if unchanged:
+        print(f"{OUTPUT_FILE} already up to date ({len(thoughts)} thoughts)")
+    else:
+        print(f"Synced {len(thoughts)} thoughts to {OUTPUT_FILE}")
+
+
+def watch(interval):
+    """Poll the note every `interval` seconds, re-syncing when it changes.
+
+    The connection stays open between polls, and sqlite3 reuses the
+    prepared statements for NOTE_QUERY and MTIME_QUERY, so an unchanged
+    note costs one small query per poll.
+    """
+    if not NOTES_DB.exists():
+        print(f"Error: Notes database not found at {NOTES_DB}", file=sys.stderr)
+        sys.exit(1)
 
-    print(f"Synced {len(thoughts)} thoughts to {OUTPUT_FILE}")
+    # Unlike a single run, there's no fallback to a copy here: polling a
+    # snapshot would never see the note change
+    conn = None
+    try:
+        conn = _connect(f"{NOTES_DB.as_uri()}?mode=ro")
+        row = _fetch_note(conn)
+    except sqlite3.DatabaseError as e:
+        if conn is not None:
+            conn.close()
+        print(f"Error: Can't read {NOTES_DB} in place ({e}). "
+              "--watch needs read-only access to the live database; "
+              "run without --watch to sync from a copy.", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        thoughts, last_mtime = _parse_note_row(row)
+        write_thoughts(thoughts, last_mtime)
+        missing = False
+        while True:
+            time.sleep(interval)
+            try:
+                row = conn.execute(MTIME_QUERY, (NOTE_TITLE,)).fetchone()
+                if row is None:
+                    note = None
+                elif missing or row[0] != last_mtime:
+                    note = _fetch_note(conn)
+                else:
+                    continue
+            except sqlite3.OperationalError as e:
+                # e.g. "database is locked" while Notes checkpoints its WAL
+                print(f"Warning: Couldn't poll the Notes database ({e}), "
+                      f"retrying in {interval:g}s.", file=sys.stderr)
+                continue
+
+            # The note may be renamed or deleted while we're watching; keep
+            # polling until it's back rather than exiting
+            if note is None:
+                if not missing:
+                    print(f"Warning: No note titled '{NOTE_TITLE}' found, "
+                          "waiting for it to reappear.", file=sys.stderr)
+                    missing = True
+                continue
+            missing = False
+
+            thoughts, last_mtime = _parse_note_row(note)
+            write_thoughts(thoughts, last_mtime)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        conn.close()
+
+
+def _positive_seconds(value):
+    """argparse type for --watch: a number of seconds greater than zero."""
+    try:
+        seconds = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid number of seconds: {value!r}")
+    if not seconds > 0:
+        raise argparse.ArgumentTypeError(f"must be greater than 0, got {value}")
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync thoughts from Apple Notes to thoughts.json.")
+    parser.add_argument("--watch", type=_positive_seconds, metavar="SECONDS",
+                        help="keep running, checking the note for changes every SECONDS")
+    args = parser.parse_args()
+
+    if args.watch is not None:
+        watch(args.watch)
+    else:
+        write_thoughts(*get_thoughts())
 
 
 if __name__ == "__main__":